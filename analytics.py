@@ -0,0 +1,229 @@
+import copy
+import threading
+import time
+from itertools import chain
+import pandas as pd
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+from app import db
+from models import Course, Faculty, Room, TimeSlot, Schedule, TimetableGeneration
+
+SCHEDULE_COLUMNS = [
+    'schedule_id', 'batch', 'course_code', 'faculty_id', 'faculty_name',
+    'room_id', 'room_number', 'building', 'timeslot_id', 'day', 'period_number',
+]
+
+# Other worker processes can change data behind our back, so the
+# materialized metrics are fully rebuilt after this many seconds.
+ANALYTICS_TTL_SECONDS = 60
+
+class TimetableAnalytics:
+    """
+    Materialized timetable metrics across all generations: room utilization
+    per building, faculty teaching load and student idle gaps. Schedule rows
+    are kept per batch so a changed generation only reloads its own rows.
+    """
+
+    def __init__(self):
+        self.frames = {}
+        self.batch_gaps = pd.DataFrame()
+        self.rooms = pd.DataFrame(columns=['room_id', 'building'])
+        self.timeslot_count = 0
+        self.counts = {}
+        self.room_utilization = []
+        self.faculty_load = []
+        self.student_gaps = []
+        self.summary = {}
+
+    def copy(self):
+        """Copy that can be refreshed without touching this one's metrics"""
+        analytics = copy.copy(self)
+        analytics.frames = dict(self.frames)
+        return analytics
+
+    def refresh(self, batches=None):
+        """Reload every schedule, or only those of the given batches, and recompute"""
+        if batches is None:
+            self._load_dimensions()
+            self.frames = {}
+            self.batch_gaps = pd.DataFrame()
+
+        frame = self._load_schedules(batches)
+        for batch in batches or ():
+            self.frames.pop(batch, None)
+        for batch, rows in frame.groupby('batch'):
+            self.frames[batch] = rows
+
+        # Idle gaps only depend on a batch's own rows, so only the refreshed
+        # batches are recomputed
+        if batches is not None and not self.batch_gaps.empty:
+            self.batch_gaps = self.batch_gaps.drop(index=list(batches), errors='ignore')
+        new_gaps = self._gap_stats(frame)
+        if self.batch_gaps.empty:
+            self.batch_gaps = new_gaps
+        elif not new_gaps.empty:
+            self.batch_gaps = pd.concat([self.batch_gaps, new_gaps])
+
+        self._recompute()
+
+    def _load_dimensions(self):
+        """Master data counts in a single round trip, plus rooms per building"""
+        row = db.session.execute(select(
+            select(func.count(Course.id)).scalar_subquery().label('courses'),
+            select(func.count(Faculty.id)).scalar_subquery().label('faculty'),
+            select(func.count(Room.id)).scalar_subquery().label('rooms'),
+            select(func.count(TimeSlot.id)).scalar_subquery().label('timeslots'),
+        )).one()
+        self.counts = dict(row._mapping)
+        self.timeslot_count = self.counts['timeslots']
+
+        self.rooms = pd.DataFrame(
+            db.session.execute(select(Room.id, Room.building)).all(),
+            columns=['room_id', 'building'],
+        )
+        self.rooms['building'] = self.rooms['building'].fillna('Unassigned')
+
+    def _load_schedules(self, batches=None):
+        """Schedule rows joined with their dimensions in one query"""
+        query = select(
+            Schedule.id, Schedule.batch, Course.code, Faculty.id, Faculty.name,
+            Room.id, Room.number, Room.building, TimeSlot.id, TimeSlot.day, TimeSlot.period_number,
+        ).join(Course, Schedule.course_id == Course.id) \
+         .join(Faculty, Schedule.faculty_id == Faculty.id) \
+         .join(Room, Schedule.room_id == Room.id) \
+         .join(TimeSlot, Schedule.timeslot_id == TimeSlot.id)
+        if batches is not None:
+            query = query.where(Schedule.batch.in_(list(batches)))
+
+        frame = pd.DataFrame(db.session.execute(query).all(), columns=SCHEDULE_COLUMNS)
+        frame['building'] = frame['building'].fillna('Unassigned')
+        return frame
+
+    @staticmethod
+    def _gap_stats(frame):
+        """
+        Idle periods per batch: free periods between a day's first and last
+        class, summed over the week.
+        """
+        if frame.empty:
+            return pd.DataFrame()
+
+        periods = frame.drop_duplicates(['batch', 'day', 'period_number'])
+        per_day = periods.groupby(['batch', 'day'])['period_number'].agg(['min', 'max', 'count'])
+        per_day['idle'] = per_day['max'] - per_day['min'] + 1 - per_day['count']
+
+        return per_day.groupby(level='batch').agg(
+            teaching_days=('idle', 'size'),
+            idle_periods=('idle', 'sum'),
+            max_daily_idle=('idle', 'max'),
+            avg_daily_idle=('idle', 'mean'),
+        )
+
+    def _recompute(self):
+        if self.frames:
+            frame = pd.concat(self.frames.values(), ignore_index=True)
+        else:
+            frame = pd.DataFrame(columns=SCHEDULE_COLUMNS)
+
+        # Room utilization: distinct (room, slot) pairs in use over rooms x slots
+        rooms_per_building = self.rooms.groupby('building').size()
+        used = frame.drop_duplicates(['room_id', 'timeslot_id']).groupby('building').size()
+        utilization = pd.DataFrame({
+            'rooms': rooms_per_building,
+            'used_periods': used.reindex(rooms_per_building.index, fill_value=0),
+        })
+        utilization['available_periods'] = utilization['rooms'] * self.timeslot_count
+        utilization['utilization'] = (
+            utilization['used_periods'] / utilization['available_periods'].where(utilization['available_periods'] > 0)
+        ).fillna(0).round(3)
+        self.room_utilization = utilization.rename_axis('building').reset_index().to_dict('records')
+
+        # Faculty load across every generation
+        load = frame.groupby(['faculty_id', 'faculty_name']).agg(
+            periods=('timeslot_id', 'nunique'),
+            classes=('schedule_id', 'size'),
+            courses=('course_code', 'nunique'),
+            batches=('batch', 'nunique'),
+        ).reset_index().sort_values('periods', ascending=False)
+        self.faculty_load = load.to_dict('records')
+
+        gaps = self.batch_gaps.reindex(list(self.frames)) if not self.batch_gaps.empty else self.batch_gaps
+        if not gaps.empty:
+            gaps = gaps.dropna().assign(avg_daily_idle=lambda g: g['avg_daily_idle'].round(2))
+            self.student_gaps = gaps.rename_axis('batch').reset_index() \
+                .sort_values('idle_periods', ascending=False).to_dict('records')
+        else:
+            self.student_gaps = []
+
+        total_available = int(utilization['available_periods'].sum())
+        self.summary = {
+            'scheduled_classes': len(frame),
+            'room_utilization': round(int(utilization['used_periods'].sum()) / total_available, 3) if total_available else 0,
+            'avg_faculty_periods': round(float(load['periods'].mean()), 1) if not load.empty else 0,
+            'avg_daily_idle': round(float(gaps['avg_daily_idle'].mean()), 2) if not gaps.empty else 0,
+        }
+
+_analytics = None
+_analytics_loaded_at = 0.0
+_dirty_batches = set()
+_needs_full_refresh = False
+_analytics_lock = threading.Lock()
+
+def timetable_analytics():
+    """
+    Return the shared analytics, refreshing only the batches whose schedules
+    changed since the last call. Master data changes and the TTL trigger a
+    full rebuild.
+    """
+    global _analytics, _analytics_loaded_at, _needs_full_refresh, _dirty_batches
+    # Publishing commits also takes the lock, so nothing is added to the
+    # pending changes while a refresh runs. They are only cleared once the
+    # refresh succeeds, so a failed one (e.g. "database is locked") is retried
+    # by the next call.
+    with _analytics_lock:
+        expired = time.monotonic() - _analytics_loaded_at > ANALYTICS_TTL_SECONDS
+        if _analytics is None or _needs_full_refresh or expired:
+            analytics = TimetableAnalytics()
+            analytics.refresh()
+            _analytics_loaded_at = time.monotonic()
+        elif _dirty_batches:
+            # Other threads may still be rendering the current metrics
+            analytics = _analytics.copy()
+            analytics.refresh(_dirty_batches)
+        else:
+            return _analytics
+        _analytics = analytics
+        _needs_full_refresh = False
+        _dirty_batches = set()
+        return _analytics
+
+# Changes are collected per session on flush and only published once the
+# transaction commits, so a refresh never runs ahead of the data it reloads
+# and rolled back changes are never published.
+
+@event.listens_for(Session, 'after_flush')
+def _track_timetable_changes(session, flush_context):
+    """Note which batches (or whether master data) changed in this flush"""
+    batches = session.info.setdefault('analytics_dirty_batches', set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Schedule):
+            batches.add(obj.batch)
+        elif isinstance(obj, TimetableGeneration):
+            batches.add(obj.name)
+        elif isinstance(obj, (Course, Faculty, Room, TimeSlot)):
+            session.info['analytics_full_refresh'] = True
+
+@event.listens_for(Session, 'after_commit')
+def _publish_timetable_changes(session):
+    global _needs_full_refresh
+    batches = session.info.pop('analytics_dirty_batches', None)
+    full_refresh = session.info.pop('analytics_full_refresh', False)
+    if batches or full_refresh:
+        with _analytics_lock:
+            _dirty_batches.update(batches or ())
+            _needs_full_refresh = _needs_full_refresh or full_refresh
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_timetable_changes(session):
+    session.info.pop('analytics_dirty_batches', None)
+    session.info.pop('analytics_full_refresh', None)
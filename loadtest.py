@@ -0,0 +1,338 @@
+"""
+Load-test the web tier against a local stand-in database.
+
+Seeds a synthetic campus into SQLite (a fresh temp file by default) or any
+DATABASE_URL, starts the app under gunicorn, then drives concurrent simulated
+users against the timetable, export and generate routes and reports
+throughput and p50/p95/p99 latency per route. SQLite "database is locked"
+errors seen in responses or in the server log are flagged as lock contention.
+
+    python loadtest.py --users 20 --duration 30
+    python loadtest.py --database-url postgresql://localhost/timetable_load --reset
+    python loadtest.py --url http://127.0.0.1:5000 --database-url sqlite:////tmp/load.db
+"""
+import argparse
+import http.cookiejar
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+LOCK_MESSAGE = 'database is locked'
+# Flashed by /generate/run when the scheduler fails or raises
+GENERATE_FAILURES = ('Failed to generate', 'Error generating timetable')
+DEFAULT_MIX = 'timetable=70,export=25,generate=5'
+SEMESTER = '1st'
+BATCH = 'A'
+
+class RouteStats:
+    """Latencies and failures collected for one route"""
+
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.lock_errors = 0
+        self.statuses = {}
+
+    def record(self, latency, status, locked, failed=False):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if failed or status == 0 or status >= 500:
+            self.errors += 1
+        if locked:
+            self.lock_errors += 1
+
+class NoRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Surface redirects as HTTPError so only the request itself is timed"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+def parse_mix(mix):
+    """Parse 'route=weight,...' into a dict of weights"""
+    weights = {}
+    for part in mix.split(','):
+        route, weight = part.split('=')
+        if route not in ('timetable', 'export', 'generate'):
+            raise ValueError(f'Unknown route in mix: {route}')
+        weights[route] = int(weight)
+    return weights
+
+def seed_campus(args):
+    """
+    Create the schema and a synthetic campus through the app's own models and
+    routes, then generate one timetable per department. Returns the
+    generation ids and department names to drive load against.
+    """
+    try:
+        from app import app, db
+    except ImportError:
+        sys.exit('loadtest.py needs the full app module: app.py must define the Flask app and its SQLAlchemy db')
+    import routes  # registers the views the test client and the load drive
+    from models import Course, Faculty, Room, TimetableGeneration
+
+    # The engine is created when the app module initialises SQLAlchemy, so the
+    # URL can't be changed from here; refuse to seed some other database
+    configured = app.config.get('SQLALCHEMY_DATABASE_URI')
+    if configured != args.database_url:
+        sys.exit(f'app.py is configured for {configured!r}, not {args.database_url!r}; '
+                 f'it must read its database URL from DATABASE_URL')
+
+    with app.app_context():
+        if args.reset:
+            db.drop_all()
+        db.create_all()
+
+        client = app.test_client()
+        # Visiting the generate page creates the default time slots
+        client.get('/generate')
+
+        departments = [f'Dept{d + 1}' for d in range(args.departments)]
+        if Course.query.count() == 0:
+            rng = random.Random(args.seed)
+            for d, department in enumerate(departments):
+                codes = []
+                for c in range(args.courses):
+                    code = f'D{d + 1}C{c + 1:02d}'
+                    codes.append(code)
+                    db.session.add(Course(
+                        code=code,
+                        name=f'{department} Course {c + 1}',
+                        hours_per_week=rng.choice([2, 3, 3, 4]),
+                        semester=SEMESTER,
+                        department=department,
+                        is_lab=(c % 4 == 3),
+                        enrollment=rng.choice([None, 30, 60]),
+                    ))
+                # Every course gets at least two qualified faculty members
+                for f in range(args.faculty):
+                    subjects = [code for i, code in enumerate(codes) if i % args.faculty in (f, (f + 1) % args.faculty)]
+                    db.session.add(Faculty(
+                        name=f'{department} Faculty {f + 1}',
+                        email=f'd{d + 1}f{f + 1}@loadtest.local',
+                        department=department,
+                        subjects=', '.join(subjects),
+                    ))
+            for r in range(args.rooms):
+                is_lab = r % 5 == 4
+                db.session.add(Room(
+                    number=f'{"L" if is_lab else "R"}{r + 1:03d}',
+                    capacity=rng.choice([30, 40]) if is_lab else rng.choice([40, 60, 60, 120]),
+                    room_type='lab' if is_lab else 'classroom',
+                    building=f'Block {chr(ord("A") + r % 4)}',
+                ))
+            db.session.commit()
+        else:
+            departments = [d[0] for d in db.session.query(Course.department).distinct()]
+
+        for department in departments:
+            client.post('/generate/run', data={
+                'department': department, 'semester': SEMESTER, 'batch': BATCH, 'batch_size': '60',
+            })
+
+        generation_ids = [g.id for g in TimetableGeneration.query.filter_by(status='generated')]
+
+    return generation_ids, departments
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(args, env, log_file):
+    """Start gunicorn on a free local port and wait until it answers"""
+    port = free_port()
+    command = [
+        sys.executable, '-m', 'gunicorn',
+        '--workers', str(args.workers),
+        '--threads', str(args.threads),
+        '--bind', f'127.0.0.1:{port}',
+        '--timeout', '120',
+        'main:app',
+    ]
+    server = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                              env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    base_url = f'http://127.0.0.1:{port}'
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with code {server.returncode}, see {log_file.name}')
+        try:
+            urllib.request.urlopen(base_url + '/', timeout=10).read()
+            return server, base_url
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.25)
+
+    server.terminate()
+    raise RuntimeError('gunicorn did not start within 60 seconds')
+
+def simulated_user(base_url, weights, generation_ids, departments, stats, lock, stop_at, think_time):
+    """One user with its own cookie jar, issuing weighted random requests until stop_at"""
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+                                         NoRedirectHandler())
+    routes = list(weights)
+    route_weights = [weights[route] for route in routes]
+
+    while time.monotonic() < stop_at:
+        route = random.choices(routes, route_weights)[0]
+        if route == 'generate':
+            data = urllib.parse.urlencode({
+                'department': random.choice(departments), 'semester': SEMESTER,
+                'batch': BATCH, 'batch_size': '60',
+            }).encode()
+            request = urllib.request.Request(base_url + '/generate/run', data=data)
+        else:
+            generation_id = random.choice(generation_ids)
+            request = urllib.request.Request(f'{base_url}/{route}/{generation_id}')
+
+        started = time.perf_counter()
+        location = None
+        try:
+            with opener.open(request, timeout=120) as response:
+                body = response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            body = e.read()
+            status = e.code
+            location = e.headers.get('Location')
+        except (urllib.error.URLError, OSError):
+            body = b''
+            status = 0
+        latency = time.perf_counter() - started
+
+        failed = False
+        if route == 'generate' and location:
+            # The outcome is flashed into the page the POST redirects to, so
+            # load it (untimed) the way a browser would. Errors send the user
+            # back to /generate, conflicts to the failed timetable.
+            target = urllib.parse.urljoin(base_url + '/', location)
+            failed = urllib.parse.urlparse(target).path.rstrip('/') == '/generate'
+            try:
+                with opener.open(target, timeout=120) as response:
+                    body = response.read()
+            except (urllib.error.URLError, OSError):
+                body = b''
+            failed = failed or any(message.encode() in body for message in GENERATE_FAILURES)
+
+        locked = LOCK_MESSAGE.encode() in body
+        with lock:
+            stats[route].record(latency, status, locked, failed)
+
+        if think_time:
+            time.sleep(random.uniform(0, think_time))
+
+def run_load(args, base_url, generation_ids, departments):
+    weights = parse_mix(args.mix)
+    stats = {route: RouteStats() for route in weights}
+    lock = threading.Lock()
+    stop_at = time.monotonic() + args.duration
+
+    users = [
+        threading.Thread(target=simulated_user, daemon=True,
+                         args=(base_url, weights, generation_ids, departments, stats, lock, stop_at, args.think_time))
+        for _ in range(args.users)
+    ]
+    started = time.monotonic()
+    for user in users:
+        user.start()
+    for user in users:
+        user.join()
+    return stats, time.monotonic() - started
+
+def report(stats, elapsed, server_log_locks):
+    print()
+    print(f"{'Route':<12}{'Requests':>10}{'Errors':>8}{'Req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  Statuses")
+    total_locks = server_log_locks
+    for route, route_stats in stats.items():
+        latencies = sorted(route_stats.latencies)
+        total_locks += route_stats.lock_errors
+        statuses = ', '.join(f'{code}:{count}' for code, count in sorted(route_stats.statuses.items()))
+        print(f"{route:<12}{len(latencies):>10}{route_stats.errors:>8}{len(latencies) / elapsed:>9.1f}"
+              f"{percentile(latencies, 50) * 1000:>10.1f}{percentile(latencies, 95) * 1000:>10.1f}"
+              f"{percentile(latencies, 99) * 1000:>10.1f}  {statuses}")
+
+    print()
+    if total_locks:
+        response_locks = total_locks - server_log_locks
+        print(f"LOCK CONTENTION: '{LOCK_MESSAGE}' seen {total_locks} times "
+              f"({response_locks} in responses, {server_log_locks} in server log)")
+    else:
+        print('No lock contention detected')
+    return total_locks
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-url', help='database to seed and serve (default: fresh temp SQLite file)')
+    parser.add_argument('--reset', action='store_true', help='drop and recreate all tables before seeding')
+    parser.add_argument('--url', help='load an already running server instead of starting gunicorn (requires --database-url)')
+    parser.add_argument('--users', type=int, default=20, help='concurrent simulated users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run the load')
+    parser.add_argument('--think-time', type=float, default=0.0, help='max random pause between a user\'s requests')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f'route weights (default: {DEFAULT_MIX})')
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--threads', type=int, default=2, help='gunicorn threads per worker')
+    parser.add_argument('--departments', type=int, default=4, help='synthetic departments')
+    parser.add_argument('--courses', type=int, default=8, help='courses per department')
+    parser.add_argument('--faculty', type=int, default=6, help='faculty per department')
+    parser.add_argument('--rooms', type=int, default=30, help='rooms on campus')
+    parser.add_argument('--seed', type=int, default=42, help='random seed for the synthetic campus')
+    parser.add_argument('--fail-on-lock', action='store_true', help='exit with status 1 if lock contention is seen')
+    args = parser.parse_args()
+    if args.url and not args.database_url:
+        # Seeding a temp database the server doesn't read would make every request 404
+        parser.error('--url requires --database-url pointing at the database that server uses')
+
+    workdir = tempfile.mkdtemp(prefix='timetable-load-')
+    if not args.database_url:
+        args.database_url = f"sqlite:///{os.path.join(workdir, 'loadtest.db')}"
+    # Both the seeding below and the gunicorn workers get the database from here
+    os.environ['DATABASE_URL'] = args.database_url
+    # Unbuffered so errors the workers print reach the log before it is scanned
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+
+    print(f'Seeding synthetic campus into {args.database_url}')
+    generation_ids, departments = seed_campus(args)
+    if not generation_ids:
+        print('Seeding produced no generated timetables; try more rooms or faculty')
+        return 1
+    print(f'{len(generation_ids)} timetables ready, running {args.users} users for {args.duration:.0f}s')
+
+    server = None
+    log_path = os.path.join(workdir, 'server.log')
+    with open(log_path, 'w') as log_file:
+        try:
+            if args.url:
+                base_url = args.url.rstrip('/')
+            else:
+                server, base_url = start_server(args, env, log_file)
+            stats, elapsed = run_load(args, base_url, generation_ids, departments)
+        finally:
+            if server:
+                server.terminate()
+                server.wait(timeout=30)
+
+    with open(log_path) as log_file:
+        server_log_locks = log_file.read().count(LOCK_MESSAGE)
+
+    total_locks = report(stats, elapsed, server_log_locks)
+    print(f'Server log: {log_path}')
+    return 1 if total_locks and args.fail_on_lock else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,57 @@
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+from app import db
+
+# db.create_all() only creates missing tables, so anything added to an
+# existing table after the first release is listed here and applied on start.
+
+# (table, column, column DDL)
+ADDED_COLUMNS = [
+    ('faculty', 'unavailable_slots', 'TEXT'),
+    ('room', 'unavailable_slots', 'TEXT'),
+    ('course', 'enrollment', 'INTEGER'),
+    ('course', 'block_length', 'INTEGER'),
+    ('timetable_generation', 'batch_size', 'INTEGER'),
+]
+
+# (index name, table, column) - names follow SQLAlchemy's ix_<table>_<column>
+# so fresh databases created with index=True are left untouched
+ADDED_INDEXES = [
+    ('ix_schedule_faculty_id', 'schedule', 'faculty_id'),
+    ('ix_schedule_room_id', 'schedule', 'room_id'),
+    ('ix_schedule_timeslot_id', 'schedule', 'timeslot_id'),
+    ('ix_schedule_batch', 'schedule', 'batch'),
+    ('ix_time_slot_day', 'time_slot', 'day'),
+    ('ix_room_room_type', 'room', 'room_type'),
+]
+
+def upgrade_schema():
+    """Bring an existing database up to the current models; safe to run repeatedly"""
+    tables = set(inspect(db.engine).get_table_names())
+    for table, column, ddl in ADDED_COLUMNS:
+        if table in tables and not _has_column(table, column):
+            _execute_once(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}',
+                          lambda: _has_column(table, column))
+    for name, table, column in ADDED_INDEXES:
+        # Tables that don't exist yet get their indexes from create_all
+        if table in tables:
+            _execute_once(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({column})',
+                          lambda: name in {i['name'] for i in inspect(db.engine).get_indexes(table)})
+
+def _has_column(table, column):
+    # A fresh inspector each time; they cache what they have reflected
+    return column in {c['name'] for c in inspect(db.engine).get_columns(table)}
+
+def _execute_once(statement, applied):
+    """
+    Run one DDL statement in its own transaction. Every gunicorn worker runs
+    the upgrade on start, so another worker may apply the same change first;
+    its error (e.g. "duplicate column name") is ignored once `applied()`
+    confirms the change is there.
+    """
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text(statement))
+    except DBAPIError:
+        if not applied():
+            raise
@@ -1,6 +1,46 @@
 from app import db
 from datetime import datetime
 
+# Periods per block for lab courses that don't set their own block length
+DEFAULT_LAB_BLOCK_LENGTH = 2
+
+def slot_mask(slot_ids):
+    """Pack TimeSlot ids into an integer bitmask (bit n set = slot id n)"""
+    mask = 0
+    for slot_id in slot_ids:
+        mask |= 1 << int(slot_id)
+    return mask
+
+def mask_slot_ids(mask):
+    """Unpack a bitmask into the sorted TimeSlot ids it contains"""
+    slot_ids = []
+    slot_id = 0
+    while mask:
+        if mask & 1:
+            slot_ids.append(slot_id)
+        mask >>= 1
+        slot_id += 1
+    return slot_ids
+
+class AvailabilityMixin:
+    """
+    Blocked time slots stored as a hex-encoded bitmask over TimeSlot ids, so
+    the scheduler can intersect availability with a single AND.
+    """
+    unavailable_slots = db.Column(db.Text)  # Hex bitmask of blocked TimeSlot ids
+
+    def get_unavailable_mask(self):
+        if self.unavailable_slots:
+            return int(self.unavailable_slots, 16)
+        return 0
+
+    def get_unavailable_slot_ids(self):
+        return mask_slot_ids(self.get_unavailable_mask())
+
+    def set_unavailable_slot_ids(self, slot_ids):
+        mask = slot_mask(slot_ids)
+        self.unavailable_slots = format(mask, 'x') if mask else None
+
 class Course(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(20), unique=True, nullable=False)
@@ -9,12 +49,29 @@ class Course(db.Model):
     semester = db.Column(db.String(20), nullable=False)
     department = db.Column(db.String(50), nullable=False)
     is_lab = db.Column(db.Boolean, default=False)
+    enrollment = db.Column(db.Integer)  # Expected number of students, None = use batch size
+    block_length = db.Column(db.Integer)  # Consecutive periods per session, None = default
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
         return f'<Course {self.code}: {self.name}>'
 
-class Faculty(db.Model):
+    def get_block_length(self):
+        if self.block_length:
+            return min(self.block_length, self.hours_per_week)
+        if self.is_lab:
+            return min(DEFAULT_LAB_BLOCK_LENGTH, self.hours_per_week)
+        return 1
+
+    def get_blocks(self):
+        """Split the weekly hours into sessions of consecutive periods, e.g. 5 hours in blocks of 2 -> [2, 2, 1]"""
+        length = self.get_block_length()
+        blocks = [length] * (self.hours_per_week // length)
+        if self.hours_per_week % length:
+            blocks.append(self.hours_per_week % length)
+        return blocks
+
+class Faculty(AvailabilityMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
@@ -30,11 +87,11 @@ class Faculty(db.Model):
             return [s.strip() for s in self.subjects.split(',')]
         return []
 
-class Room(db.Model):
+class Room(AvailabilityMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     number = db.Column(db.String(20), unique=True, nullable=False)
     capacity = db.Column(db.Integer, nullable=False)
-    room_type = db.Column(db.String(20), nullable=False)  # 'classroom' or 'lab'
+    room_type = db.Column(db.String(20), nullable=False, index=True)  # 'classroom' or 'lab'
     building = db.Column(db.String(50))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
@@ -43,7 +100,7 @@ class Room(db.Model):
 
 class TimeSlot(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    day = db.Column(db.String(10), nullable=False)  # Monday, Tuesday, etc.
+    day = db.Column(db.String(10), nullable=False, index=True)  # Monday, Tuesday, etc.
     start_time = db.Column(db.String(10), nullable=False)  # HH:MM format
     end_time = db.Column(db.String(10), nullable=False)  # HH:MM format
     period_number = db.Column(db.Integer, nullable=False)
@@ -55,10 +112,10 @@ class TimeSlot(db.Model):
 class Schedule(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     course_id = db.Column(db.Integer, db.ForeignKey('course.id'), nullable=False)
-    faculty_id = db.Column(db.Integer, db.ForeignKey('faculty.id'), nullable=False)
-    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False)
-    timeslot_id = db.Column(db.Integer, db.ForeignKey('time_slot.id'), nullable=False)
-    batch = db.Column(db.String(50), nullable=False)
+    faculty_id = db.Column(db.Integer, db.ForeignKey('faculty.id'), nullable=False, index=True)
+    room_id = db.Column(db.Integer, db.ForeignKey('room.id'), nullable=False, index=True)
+    timeslot_id = db.Column(db.Integer, db.ForeignKey('time_slot.id'), nullable=False, index=True)
+    batch = db.Column(db.String(50), nullable=False, index=True)
     generated_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     # Relationships
@@ -76,6 +133,7 @@ class TimetableGeneration(db.Model):
     department = db.Column(db.String(50), nullable=False)
     semester = db.Column(db.String(20), nullable=False)
     status = db.Column(db.String(20), default='generated')  # generated, failed
+    batch_size = db.Column(db.Integer)  # Number of students in the batch
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
@@ -0,0 +1,399 @@
+import threading
+import time
+from sqlalchemy import or_
+from app import db
+from models import Course, Faculty, Room, TimeSlot, Schedule, TimetableGeneration
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+
+# Other worker processes can change schedules behind our back, so the cached
+# index is rebuilt after this many seconds even if nothing here touched it.
+INDEX_TTL_SECONDS = 30
+
+class OccupancyIndex:
+    """
+    In-memory picture of which faculty, rooms and batches are busy in every
+    time slot across the whole campus. Used to answer "what if" questions
+    about manual timetable edits without querying the database.
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.timeslots = {}
+        # day -> TimeSlot ids in period order
+        self.day_slots = {}
+        self.rooms = {}
+        self.faculty_names = {}
+        # Bitmasks of blocked TimeSlot ids
+        self.faculty_unavailable = {}
+        self.room_unavailable = {}
+        # (timeslot_id, key) -> set of schedule ids
+        self.faculty_slots = {}
+        self.room_slots = {}
+        self.batch_slots = {}
+
+    @classmethod
+    def load(cls):
+        """Build the index from the database in a handful of flat queries"""
+        index = cls()
+
+        for slot in TimeSlot.query.all():
+            index.timeslots[slot.id] = {
+                'id': slot.id,
+                'day': slot.day,
+                'period_number': slot.period_number,
+                'start_time': slot.start_time,
+                'end_time': slot.end_time,
+            }
+            index.day_slots.setdefault(slot.day, []).append(slot)
+        index.day_slots = {
+            day: [slot.id for slot in sorted(slots, key=lambda s: s.period_number)]
+            for day, slots in index.day_slots.items()
+        }
+
+        for room in Room.query.all():
+            index.rooms[room.id] = {
+                'id': room.id,
+                'number': room.number,
+                'room_type': room.room_type,
+                'capacity': room.capacity,
+            }
+            index.room_unavailable[room.id] = room.get_unavailable_mask()
+
+        for faculty in Faculty.query.all():
+            index.faculty_names[faculty.id] = faculty.name
+            index.faculty_unavailable[faculty.id] = faculty.get_unavailable_mask()
+
+        block_lengths = {course.id: course.get_block_length() for course in Course.query.all()}
+        batch_sizes = dict(db.session.query(TimetableGeneration.name, TimetableGeneration.batch_size))
+
+        rows = db.session.query(
+            Schedule.id, Schedule.course_id, Course.code, Course.is_lab, Course.enrollment,
+            Schedule.faculty_id, Schedule.room_id, Schedule.timeslot_id, Schedule.batch
+        ).join(Course, Schedule.course_id == Course.id)
+
+        for row in rows:
+            index.add({
+                'id': row.id,
+                'course_id': row.course_id,
+                'course_code': row.code,
+                'is_lab': bool(row.is_lab),
+                'block_length': block_lengths.get(row.course_id, 1),
+                'students': row.enrollment or batch_sizes.get(row.batch) or 0,
+                'faculty_id': row.faculty_id,
+                'room_id': row.room_id,
+                'timeslot_id': row.timeslot_id,
+                'batch': row.batch,
+            })
+
+        return index
+
+    def add(self, entry):
+        self.entries[entry['id']] = entry
+        slot = entry['timeslot_id']
+        self.faculty_slots.setdefault((slot, entry['faculty_id']), set()).add(entry['id'])
+        self.room_slots.setdefault((slot, entry['room_id']), set()).add(entry['id'])
+        self.batch_slots.setdefault((slot, entry['batch']), set()).add(entry['id'])
+
+    def remove(self, schedule_id):
+        entry = self.entries.pop(schedule_id)
+        slot = entry['timeslot_id']
+        self.faculty_slots[(slot, entry['faculty_id'])].discard(schedule_id)
+        self.room_slots[(slot, entry['room_id'])].discard(schedule_id)
+        self.batch_slots[(slot, entry['batch'])].discard(schedule_id)
+        return entry
+
+    def move(self, schedule_id, timeslot_id, room_id, faculty_id):
+        """Record a committed move of one entry"""
+        entry = dict(self.remove(schedule_id))
+        entry.update(timeslot_id=timeslot_id, room_id=room_id, faculty_id=faculty_id)
+        self.add(entry)
+
+    def describe(self, schedule_id):
+        """Human-readable summary of an entry for conflict listings"""
+        entry = self.entries[schedule_id]
+        slot = self.timeslots.get(entry['timeslot_id'], {})
+        return {
+            'schedule_id': schedule_id,
+            'course_code': entry['course_code'],
+            'faculty_name': self.faculty_names.get(entry['faculty_id']),
+            'room_number': self.rooms.get(entry['room_id'], {}).get('number'),
+            'batch': entry['batch'],
+            'day': slot.get('day'),
+            'period_number': slot.get('period_number'),
+        }
+
+    def back_to_back(self, timeslot_id, next_id):
+        """True if the second slot starts when the first ends, with no break between"""
+        return _minutes(self.timeslots[next_id]['start_time']) <= _minutes(self.timeslots[timeslot_id]['end_time'])
+
+    def block(self, schedule_id):
+        """
+        The entries of the multi-period block an entry belongs to, in period
+        order: back-to-back periods of the same course and batch on one day,
+        cut into the course's block length. Single-period courses are their
+        own block.
+        """
+        entry = self.entries[schedule_id]
+        if entry['block_length'] <= 1:
+            return [entry]
+
+        runs, run, previous = [], [], None
+        for slot_id in self.day_slots[self.timeslots[entry['timeslot_id']]['day']]:
+            member = next((self.entries[s] for s in self.batch_slots.get((slot_id, entry['batch']), ())
+                           if self.entries[s]['course_id'] == entry['course_id']), None)
+            if run and (member is None or not self.back_to_back(previous, slot_id)):
+                runs.append(run)
+                run = []
+            if member is not None:
+                run.append(member)
+            previous = slot_id
+        if run:
+            runs.append(run)
+
+        run = next(run for run in runs if entry in run)
+        start = run.index(entry) // entry['block_length'] * entry['block_length']
+        return run[start:start + entry['block_length']]
+
+    def block_slots(self, block, anchor_id, timeslot_id):
+        """
+        Target slots for every entry of a block when the `anchor_id` entry lands
+        in `timeslot_id`, or None if the block doesn't fit there without
+        running off the day or across a break.
+        """
+        day_slots = self.day_slots[self.timeslots[timeslot_id]['day']]
+        start = day_slots.index(timeslot_id) - [e['id'] for e in block].index(anchor_id)
+        if start < 0 or start + len(block) > len(day_slots):
+            return None
+        slot_ids = day_slots[start:start + len(block)]
+        if not all(self.back_to_back(a, b) for a, b in zip(slot_ids, slot_ids[1:])):
+            return None
+        return slot_ids
+
+    def breaks_block(self, block, timeslot_id):
+        """Conflict for a move that would split a block or can't fit it"""
+        slot = self.timeslots[timeslot_id]
+        return {'type': 'breaks_block', 'course_code': block[0]['course_code'], 'periods': len(block),
+                'day': slot['day'], 'period_number': slot['period_number']}
+
+    def conflicts(self, entry, timeslot_id, room_id, faculty_id, ignore=()):
+        """
+        List the entries that would clash with placing `entry` at the given
+        slot, room and faculty. Entries in `ignore` are treated as already moved.
+        """
+        found = []
+        slot = self.timeslots.get(timeslot_id, {})
+        if self.faculty_unavailable.get(faculty_id, 0) >> timeslot_id & 1:
+            found.append({'type': 'faculty_unavailable', 'faculty_name': self.faculty_names.get(faculty_id),
+                          'day': slot.get('day'), 'period_number': slot.get('period_number')})
+        if self.room_unavailable.get(room_id, 0) >> timeslot_id & 1:
+            found.append({'type': 'room_unavailable', 'room_number': self.rooms.get(room_id, {}).get('number'),
+                          'day': slot.get('day'), 'period_number': slot.get('period_number')})
+        if self.rooms.get(room_id, {}).get('capacity', 0) < entry['students']:
+            found.append({'type': 'room_too_small', 'room_number': self.rooms[room_id]['number'],
+                          'capacity': self.rooms[room_id]['capacity'], 'students': entry['students']})
+
+        checks = [
+            ('faculty_conflict', self.faculty_slots.get((timeslot_id, faculty_id), ())),
+            ('room_conflict', self.room_slots.get((timeslot_id, room_id), ())),
+            ('batch_conflict', self.batch_slots.get((timeslot_id, entry['batch']), ())),
+        ]
+        for conflict_type, schedule_ids in checks:
+            for schedule_id in schedule_ids:
+                if schedule_id == entry['id'] or schedule_id in ignore:
+                    continue
+                conflict = self.describe(schedule_id)
+                conflict['type'] = conflict_type
+                found.append(conflict)
+        return found
+
+    def suggest(self, block, anchor_id, timeslot_id, room_id, faculty_id, limit=5):
+        """
+        Suggest the free (timeslot, room) pairs closest to the requested one
+        for the `anchor_id` entry, keeping the requested faculty and moving the
+        rest of its block along. Same-slot room changes come first, then
+        nearby periods on the same day, then other days.
+        """
+        ignore = [e['id'] for e in block]
+        students = block[0]['students']
+        target = self.timeslots[timeslot_id]
+        target_day = DAYS.index(target['day']) if target['day'] in DAYS else 0
+        wanted_type = self.rooms.get(room_id, {}).get('room_type')
+
+        def slot_distance(slot):
+            day = DAYS.index(slot['day']) if slot['day'] in DAYS else len(DAYS)
+            return (abs(day - target_day), abs(slot['period_number'] - target['period_number']))
+
+        def room_rank(room):
+            # Same room, then same type, then the tightest fit
+            return (room['id'] != room_id, room['room_type'] != wanted_type, room['capacity'], room['number'])
+
+        rooms = sorted(self.rooms.values(), key=room_rank)
+        suggestions = []
+        for slot in sorted(self.timeslots.values(), key=slot_distance):
+            slot_ids = self.block_slots(block, anchor_id, slot['id'])
+            if slot_ids is None or any(self.is_busy(e, s, faculty_id, ignore) for e, s in zip(block, slot_ids)):
+                continue
+            for room in rooms:
+                if (slot['id'], room['id']) == (timeslot_id, room_id):
+                    continue
+                if room['capacity'] < students:
+                    continue
+                if any(self.room_unavailable.get(room['id'], 0) >> s & 1 for s in slot_ids):
+                    continue
+                if any(other not in ignore for s in slot_ids
+                       for other in self.room_slots.get((s, room['id']), ())):
+                    continue
+                suggestions.append({
+                    'timeslot_id': slot['id'],
+                    'day': slot['day'],
+                    'period_number': slot['period_number'],
+                    'start_time': slot['start_time'],
+                    'room_id': room['id'],
+                    'room_number': room['number'],
+                })
+                break
+            if len(suggestions) >= limit:
+                break
+        return suggestions
+
+    def is_busy(self, entry, timeslot_id, faculty_id, ignore=()):
+        """True if the faculty or the batch is already busy (or blocked) in a slot"""
+        if self.faculty_unavailable.get(faculty_id, 0) >> timeslot_id & 1:
+            return True
+        for schedule_ids in (self.faculty_slots.get((timeslot_id, faculty_id), ()),
+                             self.batch_slots.get((timeslot_id, entry['batch']), ())):
+            if any(s not in ignore and s != entry['id'] for s in schedule_ids):
+                return True
+        return False
+
+    def check_move(self, schedule_id, timeslot_id=None, room_id=None, faculty_id=None):
+        """
+        Check moving one entry, together with the rest of its block;
+        unspecified targets keep their current value
+        """
+        entry = self.entries[schedule_id]
+        timeslot_id = timeslot_id or entry['timeslot_id']
+        room_id = room_id or entry['room_id']
+        faculty_id = faculty_id or entry['faculty_id']
+
+        if timeslot_id not in self.timeslots or room_id not in self.rooms \
+                or faculty_id not in self.faculty_names:
+            raise KeyError('Unknown time slot, room or faculty')
+
+        block = self.block(schedule_id)
+        moves, conflicts = self._move_block(block, schedule_id, timeslot_id, room_id, faculty_id,
+                                            [e['id'] for e in block])
+        return {
+            'ok': not conflicts,
+            'moves': moves,
+            'conflicts': conflicts,
+            'suggestions': self.suggest(block, schedule_id, timeslot_id, room_id, faculty_id) if conflicts else [],
+        }
+
+    def _move_block(self, block, anchor_id, timeslot_id, room_id, faculty_id, ignore):
+        """Moves and conflicts for placing a block with `anchor_id` in `timeslot_id`"""
+        slot_ids = self.block_slots(block, anchor_id, timeslot_id)
+        if slot_ids is None:
+            return [], [self.breaks_block(block, timeslot_id)]
+
+        moves, conflicts = [], []
+        for entry, slot_id in zip(block, slot_ids):
+            moves.append({'schedule_id': entry['id'], 'timeslot_id': slot_id,
+                          'room_id': room_id, 'faculty_id': faculty_id})
+            conflicts += self.conflicts(entry, slot_id, room_id, faculty_id, ignore)
+        return moves, conflicts
+
+    def check_swap(self, schedule_id, other_id):
+        """
+        Check exchanging the time slots of two entries' blocks, each keeping its
+        room and faculty. Each block starts where the other one started.
+        """
+        block = self.block(schedule_id)
+        other_block = self.block(other_id)
+        if other_id in [e['id'] for e in block]:
+            conflict = self.breaks_block(block, self.entries[other_id]['timeslot_id'])
+            return {'ok': False, 'moves': [], 'conflicts': [conflict], 'suggestions': []}
+
+        ignore = [e['id'] for e in block + other_block]
+        first, other_first = block[0], other_block[0]
+        moves, conflicts = self._move_block(block, first['id'], other_first['timeslot_id'],
+                                            first['room_id'], first['faculty_id'], ignore)
+        other_moves, other_conflicts = self._move_block(other_block, other_first['id'], first['timeslot_id'],
+                                                        other_first['room_id'], other_first['faculty_id'], ignore)
+        conflicts += other_conflicts
+        # Blocks of different lengths can land on top of each other, and every
+        # moved entry is ignored above, so check the moves against one another
+        for conflict_type, move, other in overlapping_moves(moves + other_moves,
+                                                           lambda s: self.entries[s]['batch']):
+            conflict = self.describe(other['schedule_id'])
+            slot = self.timeslots[other['timeslot_id']]
+            conflict.update(type=conflict_type, day=slot['day'], period_number=slot['period_number'])
+            conflicts.append(conflict)
+        return {
+            'ok': not conflicts,
+            'moves': moves + other_moves,
+            'conflicts': conflicts,
+            'suggestions': [],
+        }
+
+def _minutes(time_str):
+    hour, minute = map(int, time_str.split(':'))
+    return hour * 60 + minute
+
+_index = None
+_index_loaded_at = 0.0
+occupancy_lock = threading.RLock()
+
+def occupancy_index():
+    """
+    Return the shared occupancy index, rebuilding it when it has been
+    invalidated or is older than INDEX_TTL_SECONDS. Callers must hold
+    `occupancy_lock` while using the returned index.
+    """
+    global _index, _index_loaded_at
+    with occupancy_lock:
+        if _index is None or time.monotonic() - _index_loaded_at > INDEX_TTL_SECONDS:
+            _index = OccupancyIndex.load()
+            _index_loaded_at = time.monotonic()
+        return _index
+
+def invalidate_occupancy_index():
+    """Drop the cached index after schedules are changed in bulk"""
+    global _index
+    with occupancy_lock:
+        _index = None
+
+def overlapping_moves(moves, batch_of):
+    """
+    (conflict type, move, other move) for every pair of moves that would put
+    two moved entries in the same slot with the same faculty, room or batch.
+    find_db_conflicts ignores all moved entries, so this has to be checked too.
+    """
+    overlaps = []
+    for i, move in enumerate(moves):
+        for other in moves[i + 1:]:
+            if move['timeslot_id'] != other['timeslot_id']:
+                continue
+            if move['faculty_id'] == other['faculty_id']:
+                overlaps.append(('faculty_conflict', move, other))
+            if move['room_id'] == other['room_id']:
+                overlaps.append(('room_conflict', move, other))
+            if batch_of(move['schedule_id']) == batch_of(other['schedule_id']):
+                overlaps.append(('batch_conflict', move, other))
+    return overlaps
+
+def find_db_conflicts(schedule, timeslot_id, room_id, faculty_id, ignore_ids):
+    """
+    Re-check a move against the database inside the committing transaction,
+    so a stale in-memory index can never let a clash through.
+    """
+    return Schedule.query.filter(
+        Schedule.timeslot_id == timeslot_id,
+        Schedule.id.notin_(ignore_ids),
+        or_(
+            Schedule.faculty_id == faculty_id,
+            Schedule.room_id == room_id,
+            Schedule.batch == schedule.batch,
+        )
+    ).all()
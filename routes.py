@@ -1,12 +1,21 @@
 from flask import render_template, request, redirect, url_for, flash, make_response, jsonify
+from sqlalchemy.orm import joinedload, contains_eager
 from app import app, db
 from models import Course, Faculty, Room, TimeSlot, Schedule, TimetableGeneration
 from scheduler import TimetableScheduler
+from occupancy import occupancy_index, occupancy_lock, invalidate_occupancy_index, find_db_conflicts, overlapping_moves
+from analytics import timetable_analytics
+from migrations import upgrade_schema
+import time
 import io
 import pandas as pd
 from openpyxl import Workbook
 from openpyxl.styles import Font, Alignment, PatternFill
 
+# Add columns and indexes that create_all() won't add to existing tables
+with app.app_context():
+    upgrade_schema()
+
 @app.template_filter('time12')
 def time12_filter(time_str):
     """Convert 24-hour time format to 12-hour format with AM/PM"""
@@ -29,24 +38,48 @@ def time12_filter(time_str):
 @app.route('/')
 def index():
     """Dashboard showing overview of data and recent timetables"""
-    courses_count = Course.query.count()
-    faculty_count = Faculty.query.count()
-    rooms_count = Room.query.count()
-    timeslots_count = TimeSlot.query.count()
+    analytics = timetable_analytics()
     recent_timetables = TimetableGeneration.query.order_by(TimetableGeneration.created_at.desc()).limit(5).all()
     
     return render_template('index.html', 
-                         courses_count=courses_count,
-                         faculty_count=faculty_count,
-                         rooms_count=rooms_count,
-                         timeslots_count=timeslots_count,
+                         courses_count=analytics.counts['courses'],
+                         faculty_count=analytics.counts['faculty'],
+                         rooms_count=analytics.counts['rooms'],
+                         timeslots_count=analytics.counts['timeslots'],
+                         summary=analytics.summary,
                          recent_timetables=recent_timetables)
 
+@app.route('/analytics')
+def analytics_dashboard():
+    """Room utilization, faculty load and student idle gaps across all timetables"""
+    analytics = timetable_analytics()
+    return render_template('analytics.html',
+                         summary=analytics.summary,
+                         room_utilization=analytics.room_utilization,
+                         faculty_load=analytics.faculty_load,
+                         student_gaps=analytics.student_gaps)
+
 @app.route('/courses')
 def courses():
     """Manage courses"""
     courses = Course.query.all()
-    return render_template('courses.html', courses=courses)
+    return render_template('courses.html', courses=courses, max_block_length=_max_block_length())
+
+def _max_block_length():
+    """Longest run of consecutive periods, or None before time slots exist"""
+    time_slots = TimeSlot.query.all()
+    return TimetableScheduler().max_block_length(time_slots) if time_slots else None
+
+def _check_block_length(course):
+    """Reject block lengths that no run of consecutive periods can hold"""
+    if course.block_length is None:
+        return
+    if course.block_length < 1:
+        raise ValueError('Block length must be at least 1')
+    longest = _max_block_length()
+    if longest and course.block_length > longest:
+        raise ValueError(f'Block length {course.block_length} is longer than the longest run of '
+                         f'consecutive periods without a break ({longest})')
 
 @app.route('/courses/add', methods=['POST'])
 def add_course():
@@ -58,8 +91,11 @@ def add_course():
             hours_per_week=int(request.form['hours_per_week']),
             semester=request.form['semester'],
             department=request.form['department'],
-            is_lab=bool(request.form.get('is_lab'))
+            is_lab=bool(request.form.get('is_lab')),
+            enrollment=int(request.form['enrollment']) if request.form.get('enrollment') else None,
+            block_length=int(request.form['block_length']) if request.form.get('block_length') else None
         )
+        _check_block_length(course)
         db.session.add(course)
         db.session.commit()
         flash('Course added successfully!', 'success')
@@ -80,7 +116,11 @@ def edit_course(course_id):
         course.semester = request.form['semester']
         course.department = request.form['department']
         course.is_lab = 'is_lab' in request.form
+        course.enrollment = int(request.form['enrollment']) if request.form.get('enrollment') else None
+        course.block_length = int(request.form['block_length']) if request.form.get('block_length') else None
+        _check_block_length(course)
         db.session.commit()
+        invalidate_occupancy_index()
         flash('Course updated successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -98,6 +138,7 @@ def delete_course(course_id):
         # Then delete the course
         db.session.delete(course)
         db.session.commit()
+        invalidate_occupancy_index()
         flash('Course deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -110,7 +151,10 @@ def faculty():
     """Manage faculty"""
     faculty_list = Faculty.query.all()
     courses = Course.query.all()
-    return render_template('faculty.html', faculty_list=faculty_list, courses=courses)
+    time_slots = TimeSlot.query.order_by(TimeSlot.period_number).all()
+    days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+    return render_template('faculty.html', faculty_list=faculty_list, courses=courses,
+                         time_slots=time_slots, days=days)
 
 @app.route('/faculty/add', methods=['POST'])
 def add_faculty():
@@ -122,8 +166,10 @@ def add_faculty():
             department=request.form['department'],
             subjects=request.form['subjects']
         )
+        faculty.set_unavailable_slot_ids(request.form.getlist('unavailable_slots'))
         db.session.add(faculty)
         db.session.commit()
+        invalidate_occupancy_index()
         flash('Faculty added successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -140,7 +186,9 @@ def edit_faculty(faculty_id):
         faculty.email = request.form['email']
         faculty.department = request.form['department']
         faculty.subjects = request.form['subjects']
+        faculty.set_unavailable_slot_ids(request.form.getlist('unavailable_slots'))
         db.session.commit()
+        invalidate_occupancy_index()
         flash('Faculty updated successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -158,6 +206,7 @@ def delete_faculty(faculty_id):
         # Then delete the faculty
         db.session.delete(faculty)
         db.session.commit()
+        invalidate_occupancy_index()
         flash('Faculty deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -169,7 +218,9 @@ def delete_faculty(faculty_id):
 def rooms():
     """Manage rooms"""
     rooms_list = Room.query.all()
-    return render_template('rooms.html', rooms=rooms_list)
+    time_slots = TimeSlot.query.order_by(TimeSlot.period_number).all()
+    days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+    return render_template('rooms.html', rooms=rooms_list, time_slots=time_slots, days=days)
 
 @app.route('/rooms/add', methods=['POST'])
 def add_room():
@@ -181,8 +232,10 @@ def add_room():
             room_type=request.form['room_type'],
             building=request.form.get('building', '')
         )
+        room.set_unavailable_slot_ids(request.form.getlist('unavailable_slots'))
         db.session.add(room)
         db.session.commit()
+        invalidate_occupancy_index()
         flash('Room added successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -199,7 +252,9 @@ def edit_room(room_id):
         room.room_type = request.form['room_type']
         room.capacity = int(request.form['capacity'])
         room.building = request.form['building'] if request.form['building'] else None
+        room.set_unavailable_slot_ids(request.form.getlist('unavailable_slots'))
         db.session.commit()
+        invalidate_occupancy_index()
         flash('Room updated successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -217,6 +272,7 @@ def delete_room(room_id):
         # Then delete the room
         db.session.delete(room)
         db.session.commit()
+        invalidate_occupancy_index()
         flash('Room deleted successfully!', 'success')
     except Exception as e:
         db.session.rollback()
@@ -296,6 +352,7 @@ def run_generation():
         department = request.form['department']
         semester = request.form['semester']
         batch = request.form['batch']
+        batch_size = int(request.form['batch_size']) if request.form.get('batch_size') else None
         name = f"{department} - {semester} - {batch}"
         
         # Clear existing schedules for this combination
@@ -305,21 +362,23 @@ def run_generation():
         generation = TimetableGeneration(
             name=name,
             department=department,
-            semester=semester
+            semester=semester,
+            batch_size=batch_size
         )
         db.session.add(generation)
         db.session.commit()
         
         # Run the scheduling algorithm
         scheduler = TimetableScheduler()
-        success = scheduler.generate_timetable(department, semester, name)
+        success = scheduler.generate_timetable(department, semester, name, batch_size)
+        invalidate_occupancy_index()
         
         if success:
             generation.status = 'generated'
             flash('Timetable generated successfully!', 'success')
         else:
             generation.status = 'failed'
-            flash('Failed to generate conflict-free timetable. Please check constraints.', 'error')
+            flash(f'Failed to generate conflict-free timetable: {scheduler.error}. Please check constraints.', 'error')
         
         db.session.commit()
         
@@ -389,15 +448,120 @@ def view_timetable(generation_id):
         period = schedule.timeslot.period_number
         room_timetable[room_number][day][period] = schedule
     
+    rooms_list = Room.query.order_by(Room.number).all()
+    faculty_list = Faculty.query.order_by(Faculty.name).all()
+    
     return render_template('timetable.html',
                          generation=generation,
                          schedules=schedules,
+                         rooms=rooms_list,
+                         faculty_list=faculty_list,
                          timetable_grid=timetable_grid,
                          faculty_timetable=faculty_timetable,
                          room_timetable=room_timetable,
                          time_slots=time_slots,
                          days=days)
 
+def _check_schedule_change(generation, data):
+    """
+    Run a move or swap request against the occupancy index.
+    Must be called with occupancy_lock held.
+    """
+    def read_id(name):
+        value = data.get(name)
+        if value in (None, ''):
+            return None
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise APIError(f"'{name}' must be an integer")
+
+    schedule_id = read_id('schedule_id')
+    if schedule_id is None:
+        raise APIError("'schedule_id' is required")
+    swap_with = read_id('swap_with')
+
+    # A miss usually means rows were added since the index was built
+    for attempt in range(2):
+        index = occupancy_index()
+        ids = [schedule_id] + ([swap_with] if swap_with else [])
+        try:
+            if any(index.entries[i]['batch'] != generation.name for i in ids):
+                raise APIError('Schedule entry does not belong to this timetable', 404)
+            if swap_with:
+                return index.check_swap(schedule_id, swap_with)
+            return index.check_move(schedule_id,
+                                    timeslot_id=read_id('timeslot_id'),
+                                    room_id=read_id('room_id'),
+                                    faculty_id=read_id('faculty_id'))
+        except KeyError:
+            if attempt:
+                raise APIError('Unknown schedule entry, time slot, room or faculty', 404)
+            invalidate_occupancy_index()
+
+@app.route('/timetable/<int:generation_id>/check-move', methods=['POST'])
+def check_schedule_move(generation_id):
+    """Check whether moving or swapping a schedule entry would cause conflicts"""
+    started = time.perf_counter()
+    generation = TimetableGeneration.query.get_or_404(generation_id)
+    data = request.get_json(silent=True) or request.form
+
+    with occupancy_lock:
+        result = _check_schedule_change(generation, data)
+
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    return jsonify(result)
+
+@app.route('/timetable/<int:generation_id>/move', methods=['POST'])
+def apply_schedule_move(generation_id):
+    """Apply a conflict-free move or swap of schedule entries in one transaction"""
+    generation = TimetableGeneration.query.get_or_404(generation_id)
+    data = request.get_json(silent=True) or request.form
+
+    with occupancy_lock:
+        result = _check_schedule_change(generation, data)
+        if not result['ok']:
+            return jsonify(result), 409
+
+        moves = result['moves']
+        ignore_ids = [move['schedule_id'] for move in moves]
+        try:
+            schedules = {move['schedule_id']: db.session.get(Schedule, move['schedule_id']) for move in moves}
+            overlaps = overlapping_moves(moves, lambda schedule_id: schedules[schedule_id].batch)
+            if overlaps:
+                db.session.rollback()
+                result['ok'] = False
+                result['conflicts'] = [{'schedule_id': other['schedule_id'], 'type': conflict_type}
+                                       for conflict_type, move, other in overlaps]
+                return jsonify(result), 409
+
+            for move in moves:
+                schedule = schedules[move['schedule_id']]
+                clashes = find_db_conflicts(schedule, move['timeslot_id'], move['room_id'],
+                                            move['faculty_id'], ignore_ids)
+                if clashes:
+                    db.session.rollback()
+                    invalidate_occupancy_index()
+                    result['ok'] = False
+                    result['conflicts'] = [{'schedule_id': clash.id, 'type': 'stale_index'}
+                                           for clash in clashes]
+                    return jsonify(result), 409
+
+                schedule.timeslot_id = move['timeslot_id']
+                schedule.room_id = move['room_id']
+                schedule.faculty_id = move['faculty_id']
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            invalidate_occupancy_index()
+            raise APIError(f'Error applying move: {str(e)}', 500)
+
+        index = occupancy_index()
+        for move in moves:
+            index.move(move['schedule_id'], move['timeslot_id'], move['room_id'], move['faculty_id'])
+
+    return jsonify(result)
+
 @app.route('/export/<int:generation_id>')
 def export_timetable(generation_id):
     """Export timetable to Excel"""
@@ -462,3 +626,235 @@ def export_timetable(generation_id):
     response.headers['Content-Disposition'] = f'attachment; filename=timetable_{generation.name.replace(" ", "_")}.xlsx'
     
     return response
+
+
+# ---------------------------------------------------------------------------
+# Read-only JSON API
+# ---------------------------------------------------------------------------
+
+API_DEFAULT_LIMIT = 50
+API_MAX_LIMIT = 200
+
+def _isoformat(value):
+    return value.isoformat() if value else None
+
+COURSE_FIELDS = {
+    'id': lambda c: c.id,
+    'code': lambda c: c.code,
+    'name': lambda c: c.name,
+    'hours_per_week': lambda c: c.hours_per_week,
+    'semester': lambda c: c.semester,
+    'department': lambda c: c.department,
+    'is_lab': lambda c: bool(c.is_lab),
+    'enrollment': lambda c: c.enrollment,
+    'block_length': lambda c: c.get_block_length(),
+    'created_at': lambda c: _isoformat(c.created_at),
+}
+
+FACULTY_FIELDS = {
+    'id': lambda f: f.id,
+    'name': lambda f: f.name,
+    'email': lambda f: f.email,
+    'department': lambda f: f.department,
+    'subjects': lambda f: f.get_subjects_list(),
+    'unavailable_slots': lambda f: f.get_unavailable_slot_ids(),
+    'created_at': lambda f: _isoformat(f.created_at),
+}
+
+ROOM_FIELDS = {
+    'id': lambda r: r.id,
+    'number': lambda r: r.number,
+    'capacity': lambda r: r.capacity,
+    'room_type': lambda r: r.room_type,
+    'building': lambda r: r.building,
+    'unavailable_slots': lambda r: r.get_unavailable_slot_ids(),
+    'created_at': lambda r: _isoformat(r.created_at),
+}
+
+TIMESLOT_FIELDS = {
+    'id': lambda t: t.id,
+    'day': lambda t: t.day,
+    'start_time': lambda t: t.start_time,
+    'end_time': lambda t: t.end_time,
+    'period_number': lambda t: t.period_number,
+}
+
+GENERATION_FIELDS = {
+    'id': lambda g: g.id,
+    'name': lambda g: g.name,
+    'department': lambda g: g.department,
+    'semester': lambda g: g.semester,
+    'status': lambda g: g.status,
+    'batch_size': lambda g: g.batch_size,
+    'created_at': lambda g: _isoformat(g.created_at),
+}
+
+# Schedule rows are flattened so a client gets everything it needs for a
+# timetable cell without following links to the other endpoints.
+SCHEDULE_FIELDS = {
+    'id': lambda s: s.id,
+    'batch': lambda s: s.batch,
+    'course_id': lambda s: s.course_id,
+    'course_code': lambda s: s.course.code,
+    'course_name': lambda s: s.course.name,
+    'faculty_id': lambda s: s.faculty_id,
+    'faculty_name': lambda s: s.faculty.name,
+    'room_id': lambda s: s.room_id,
+    'room_number': lambda s: s.room.number,
+    'timeslot_id': lambda s: s.timeslot_id,
+    'day': lambda s: s.timeslot.day,
+    'start_time': lambda s: s.timeslot.start_time,
+    'end_time': lambda s: s.timeslot.end_time,
+    'period_number': lambda s: s.timeslot.period_number,
+    'generated_at': lambda s: _isoformat(s.generated_at),
+}
+
+class APIError(Exception):
+    """Raised by API helpers to return a JSON error response"""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+@app.errorhandler(APIError)
+def handle_api_error(error):
+    return jsonify({'error': error.message}), error.status_code
+
+def _api_int_arg(name, default=None):
+    """Read an optional integer query argument"""
+    value = request.args.get(name)
+    if value in (None, ''):
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise APIError(f"'{name}' must be an integer")
+
+def _api_fields(field_map):
+    """Resolve the ?fields= selection against the fields a resource exposes"""
+    requested = request.args.get('fields')
+    if not requested:
+        return list(field_map)
+
+    fields = [f.strip() for f in requested.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in field_map]
+    if unknown:
+        raise APIError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def _api_page(query, model, field_map):
+    """
+    Return one keyset-paginated page of a query as a conditional JSON response.
+    Clients pass the previous page's next_cursor as ?after= to continue.
+    """
+    fields = _api_fields(field_map)
+    after = _api_int_arg('after', 0)
+    limit = _api_int_arg('limit', API_DEFAULT_LIMIT)
+    if limit < 1:
+        raise APIError("'limit' must be positive")
+    limit = min(limit, API_MAX_LIMIT)
+
+    rows = query.filter(model.id > after).order_by(model.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    getters = [(field, field_map[field]) for field in fields]
+    data = [{field: getter(row) for field, getter in getters} for row in rows]
+
+    response = jsonify({
+        'data': data,
+        'next_cursor': rows[-1].id if has_more else None,
+    })
+    response.headers['Cache-Control'] = 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/api/courses')
+def api_courses():
+    """List courses, optionally filtered by department and semester"""
+    query = Course.query
+    if request.args.get('department'):
+        query = query.filter(Course.department == request.args['department'])
+    if request.args.get('semester'):
+        query = query.filter(Course.semester == request.args['semester'])
+    return _api_page(query, Course, COURSE_FIELDS)
+
+@app.route('/api/faculty')
+def api_faculty():
+    """List faculty, optionally filtered by department"""
+    query = Faculty.query
+    if request.args.get('department'):
+        query = query.filter(Faculty.department == request.args['department'])
+    return _api_page(query, Faculty, FACULTY_FIELDS)
+
+@app.route('/api/rooms')
+def api_rooms():
+    """List rooms, optionally filtered by room type"""
+    query = Room.query
+    if request.args.get('room_type'):
+        query = query.filter(Room.room_type == request.args['room_type'])
+    return _api_page(query, Room, ROOM_FIELDS)
+
+@app.route('/api/timeslots')
+def api_timeslots():
+    """List time slots, optionally filtered by day"""
+    query = TimeSlot.query
+    if request.args.get('day'):
+        query = query.filter(TimeSlot.day == request.args['day'])
+    return _api_page(query, TimeSlot, TIMESLOT_FIELDS)
+
+@app.route('/api/generations')
+def api_generations():
+    """List timetable generations, optionally filtered by department, semester and status"""
+    query = TimetableGeneration.query
+    for arg in ('department', 'semester', 'status'):
+        if request.args.get(arg):
+            query = query.filter(getattr(TimetableGeneration, arg) == request.args[arg])
+    return _api_page(query, TimetableGeneration, GENERATION_FIELDS)
+
+@app.route('/api/analytics')
+def api_analytics():
+    """Materialized timetable analytics"""
+    analytics = timetable_analytics()
+    response = jsonify({
+        'summary': analytics.summary,
+        'room_utilization': analytics.room_utilization,
+        'faculty_load': analytics.faculty_load,
+        'student_gaps': analytics.student_gaps,
+    })
+    response.headers['Cache-Control'] = 'no-cache'
+    response.add_etag()
+    return response.make_conditional(request)
+
+@app.route('/api/schedules')
+def api_schedules():
+    """List schedule entries filtered by generation, faculty, room and day"""
+    # The time slot is joined (rather than eagerly loaded separately) so the
+    # day filter and the serialized slot come from the same row.
+    query = Schedule.query.join(Schedule.timeslot).options(
+        contains_eager(Schedule.timeslot),
+        joinedload(Schedule.course),
+        joinedload(Schedule.faculty),
+        joinedload(Schedule.room),
+    )
+
+    generation_id = _api_int_arg('generation')
+    if generation_id is not None:
+        generation = db.session.get(TimetableGeneration, generation_id)
+        if generation is None:
+            raise APIError('Generation not found', 404)
+        query = query.filter(Schedule.batch == generation.name)
+
+    faculty_id = _api_int_arg('faculty')
+    if faculty_id is not None:
+        query = query.filter(Schedule.faculty_id == faculty_id)
+
+    room_id = _api_int_arg('room')
+    if room_id is not None:
+        query = query.filter(Schedule.room_id == room_id)
+
+    if request.args.get('day'):
+        query = query.filter(TimeSlot.day == request.args['day'])
+
+    return _api_page(query, Schedule, SCHEDULE_FIELDS)
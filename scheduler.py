@@ -1,6 +1,7 @@
+import bisect
 import random
 from app import db
-from models import Course, Faculty, Room, TimeSlot, Schedule
+from models import Course, Faculty, Room, TimeSlot, Schedule, slot_mask
 
 class TimetableScheduler:
     """
@@ -10,10 +11,24 @@ class TimetableScheduler:
     
     def __init__(self):
         self.max_attempts = 1000
+        # Longest break (minutes) allowed inside a multi-period block; the
+        # default 0 keeps blocks from spanning tea or lunch breaks
+        self.max_block_gap = 0
+        # Why the last generate_timetable() call failed, for showing to the user
+        self.error = None
+        self.faculty_masks = {}
+        self.room_masks = {}
+        self.room_index = {}
+        self.block_index = {}
+        self._block_domains = {}
+        # (timeslot_id, faculty_id) and (timeslot_id, room_id) already taken
+        self._busy_faculty = set()
+        self._busy_rooms = set()
     
-    def generate_timetable(self, department, semester, batch):
+    def generate_timetable(self, department, semester, batch, batch_size=None):
         """
         Generate a timetable for a specific department and semester.
+        batch_size is the student count used for courses without their own enrollment.
         Returns True if successful, False otherwise.
         """
         try:
@@ -21,8 +36,7 @@ class TimetableScheduler:
             courses = Course.query.filter_by(department=department, semester=semester).all()
             
             if not courses:
-                print(f"No courses found for {department} - {semester}")
-                return False
+                return self._fail(f"No courses found for {department} - {semester}")
             
             # Get available faculty who can teach these courses
             available_faculty = {}
@@ -33,41 +47,76 @@ class TimetableScheduler:
                 ).all()
                 
                 if not faculty_list:
-                    print(f"No faculty found for course {course.code}")
-                    return False
+                    return self._fail(f"No faculty found for course {course.code}")
                 
                 available_faculty[course.code] = faculty_list
             
             # Get available rooms
             rooms = Room.query.all()
             if not rooms:
-                print("No rooms available")
-                return False
+                return self._fail("No rooms available")
             
             # Get time slots
             time_slots = TimeSlot.query.all()
             if not time_slots:
-                print("No time slots available")
-                return False
+                return self._fail("No time slots available")
+            
+            # Intersect availability into per-faculty and per-room slot masks
+            # up front so blocked slots are never sampled
+            all_slots = slot_mask(slot.id for slot in time_slots)
+            self._block_domains = {}
+            
+            self.room_masks = {room.id: all_slots & ~room.get_unavailable_mask() for room in rooms}
+            rooms = [room for room in rooms if self.room_masks[room.id]]
+            if not rooms:
+                return self._fail("No rooms available in any time slot")
+            
+            self.faculty_masks = {}
+            for course in courses:
+                for faculty in available_faculty[course.code]:
+                    self.faculty_masks[faculty.id] = all_slots & ~faculty.get_unavailable_mask()
+                available_faculty[course.code] = [
+                    faculty for faculty in available_faculty[course.code] if self.faculty_masks[faculty.id]
+                ]
+                if not available_faculty[course.code]:
+                    return self._fail(f"No faculty available in any time slot for course {course.code}")
+            
+            self._build_room_index(rooms)
+            self._build_block_index(time_slots, {length for course in courses for length in course.get_blocks()})
+            # A block that fits in no run of periods would only burn max_attempts
+            for course in courses:
+                for length in set(course.get_blocks()):
+                    if not self.block_index[length]:
+                        return self._fail(
+                            f"{course.code} needs {length} consecutive periods but the longest run "
+                            f"without a break is {self.max_block_length(time_slots)}"
+                        )
+            self._busy_faculty = set()
+            self._busy_rooms = set()
             
             # Generate schedule assignments
             schedule_assignments = []
             
-            for course in courses:
-                # Each course needs to be scheduled for its required hours per week
-                hours_needed = course.hours_per_week
+            # Courses with long blocks have the fewest places to go, so place them first
+            for course in sorted(courses, key=lambda c: c.get_block_length(), reverse=True):
+                students = course.enrollment or batch_size or 0
+                eligible_rooms = self._eligible_rooms(course, students)
+                if not eligible_rooms:
+                    return self._fail(f"No room large enough for {course.code} ({students} students)")
                 
-                for hour in range(hours_needed):
-                    assignment = self._find_valid_assignment(
-                        course, available_faculty[course.code], rooms, time_slots, 
-                        schedule_assignments, batch
+                # Each course needs its weekly hours, placed one block of consecutive periods at a time
+                for block_number, block_length in enumerate(course.get_blocks(), 1):
+                    assignments = self._find_valid_assignment(
+                        course, available_faculty[course.code], eligible_rooms, block_length, batch
                     )
                     
-                    if assignment:
-                        schedule_assignments.append(assignment)
+                    if assignments:
+                        for assignment in assignments:
+                            schedule_assignments.append(assignment)
+                            self._busy_faculty.add((assignment['timeslot'].id, assignment['faculty'].id))
+                            self._busy_rooms.add((assignment['timeslot'].id, assignment['room'].id))
                     else:
-                        print(f"Could not schedule {course.code} for hour {hour + 1}")
-                        return False
+                        return self._fail(f"Could not schedule {course.code} for block {block_number} ({block_length} periods)")
             
             # Save all assignments to database
             for assignment in schedule_assignments:
@@ -84,80 +133,172 @@ class TimetableScheduler:
             return True
             
         except Exception as e:
-            print(f"Error in timetable generation: {str(e)}")
             db.session.rollback()
-            return False
+            return self._fail(f"Error in timetable generation: {str(e)}")
+    
+    def _fail(self, message):
+        """Log and remember why generation failed; always returns False"""
+        print(message)
+        self.error = message
+        return False
     
-    def _find_valid_assignment(self, course, faculty_list, rooms, time_slots, existing_assignments, batch):
+    def _build_room_index(self, rooms):
+        """
+        Group rooms by type, each list sorted by capacity with a parallel list
+        of capacities for bisecting.
         """
-        Find a valid assignment for a course that doesn't conflict with existing assignments.
+        self.room_index = {}
+        for room in sorted(rooms, key=lambda r: r.capacity):
+            capacities, ordered_rooms = self.room_index.setdefault(room.room_type, ([], []))
+            capacities.append(room.capacity)
+            ordered_rooms.append(room)
+    
+    def _consecutive_runs(self, time_slots):
         """
+        Split each day's periods into runs of back-to-back slots. Periods
+        separated by a break longer than max_block_gap minutes never share a run.
+        """
+        runs = []
+        slots_by_day = {}
+        for slot in time_slots:
+            slots_by_day.setdefault(slot.day, []).append(slot)
+        
+        for day_slots in slots_by_day.values():
+            day_slots.sort(key=lambda s: s.period_number)
+            run = [day_slots[0]]
+            for previous, slot in zip(day_slots, day_slots[1:]):
+                if self._minutes(slot.start_time) - self._minutes(previous.end_time) <= self.max_block_gap:
+                    run.append(slot)
+                else:
+                    runs.append(run)
+                    run = [slot]
+            runs.append(run)
+        return runs
+    
+    def max_block_length(self, time_slots):
+        """Longest block of consecutive periods the time slots allow"""
+        return max((len(run) for run in self._consecutive_runs(time_slots)), default=0)
+    
+    def _build_block_index(self, time_slots, lengths):
+        """
+        Precompute every run of back-to-back periods within a day for each
+        block length needed, as (mask, slots) pairs.
+        """
+        runs = self._consecutive_runs(time_slots)
+        self.block_index = {}
+        for length in lengths:
+            self.block_index[length] = [
+                (slot_mask(slot.id for slot in run[start:start + length]), run[start:start + length])
+                for run in runs
+                for start in range(len(run) - length + 1)
+            ]
+    
+    @staticmethod
+    def _minutes(time_str):
+        hour, minute = map(int, time_str.split(':'))
+        return hour * 60 + minute
+    
+    def _eligible_rooms(self, course, students):
+        """
+        Rooms that can hold the course, smallest first. Labs prefer lab rooms
+        and only fall back to classrooms after every adequate lab.
+        """
+        room_types = ['lab', 'classroom'] if course.is_lab else ['classroom']
+        eligible = []
+        for room_type in room_types:
+            capacities, ordered_rooms = self.room_index.get(room_type, ([], []))
+            eligible.extend(ordered_rooms[bisect.bisect_left(capacities, students):])
+        return eligible
+    
+    def _find_valid_assignment(self, course, faculty_list, eligible_rooms, block_length, batch):
+        """
+        Find a valid assignment of one block of consecutive periods for a course
+        that doesn't conflict with existing assignments. The block is sampled as
+        a single decision; the room is the best fit free for the whole block.
+        Returns one assignment per period, or None.
+        """
+        rooms_mask = 0
+        for room in eligible_rooms:
+            rooms_mask |= self.room_masks.get(room.id, 0)
+        
         attempts = 0
         
         while attempts < self.max_attempts:
-            # Randomly select faculty, room, and time slot
-            faculty = random.choice(faculty_list)
-            
-            # Filter rooms based on course type
-            suitable_rooms = []
-            for room in rooms:
-                if course.is_lab and room.room_type == 'lab':
-                    suitable_rooms.append(room)
-                elif not course.is_lab and room.room_type == 'classroom':
-                    suitable_rooms.append(room)
-                # Labs can also use classrooms if needed
-                elif course.is_lab and room.room_type == 'classroom':
-                    suitable_rooms.append(room)
+            attempts += 1
             
-            if not suitable_rooms:
-                return None
+            # Randomly select faculty and a block both they and some room are free in
+            faculty = random.choice(faculty_list)
+            candidate_blocks = self._candidate_blocks(faculty, rooms_mask, block_length)
+            if not candidate_blocks:
+                continue
+            block_mask, block_slots = random.choice(candidate_blocks)
             
-            room = random.choice(suitable_rooms)
-            timeslot = random.choice(time_slots)
+            room = self._best_fit_room(eligible_rooms, block_mask, block_slots)
+            if room is None:
+                continue
             
             # Check for conflicts
-            if self._check_conflicts(faculty, room, timeslot, existing_assignments):
+            if any(self._check_conflicts(faculty, room, timeslot) for timeslot in block_slots):
                 continue
             
             # Check if this assignment already exists in database for this batch
-            existing_schedule = Schedule.query.filter_by(
-                faculty_id=faculty.id,
-                room_id=room.id,
-                timeslot_id=timeslot.id,
-                batch=batch
+            existing_schedule = Schedule.query.filter(
+                Schedule.faculty_id == faculty.id,
+                Schedule.room_id == room.id,
+                Schedule.timeslot_id.in_([timeslot.id for timeslot in block_slots]),
+                Schedule.batch == batch
             ).first()
             
             if existing_schedule:
-                attempts += 1
                 continue
             
             # Valid assignment found
-            return {
+            return [{
                 'course': course,
                 'faculty': faculty,
                 'room': room,
                 'timeslot': timeslot
-            }
-            
-            attempts += 1
+            } for timeslot in block_slots]
         
         return None
     
-    def _check_conflicts(self, faculty, room, timeslot, existing_assignments):
+    def _candidate_blocks(self, faculty, rooms_mask, block_length):
+        """
+        Blocks in which the faculty member and at least one eligible room are
+        available for every period. Domains are cached by their combined mask
+        since many faculty share one.
+        """
+        available = self.faculty_masks[faculty.id] & rooms_mask
+        key = (available, block_length)
+        if key not in self._block_domains:
+            self._block_domains[key] = [
+                block for block in self.block_index.get(block_length, [])
+                if (block[0] & available) == block[0]
+            ]
+        return self._block_domains[key]
+    
+    def _best_fit_room(self, eligible_rooms, block_mask, block_slots):
+        """Smallest eligible room that is available and still free for the whole block"""
+        for room in eligible_rooms:
+            if (self.room_masks.get(room.id, 0) & block_mask) != block_mask:
+                continue
+            if any((timeslot.id, room.id) in self._busy_rooms for timeslot in block_slots):
+                continue
+            return room
+        return None
+    
+    def _check_conflicts(self, faculty, room, timeslot):
         """
         Check if the proposed assignment conflicts with existing assignments.
         Returns True if there's a conflict, False otherwise.
         """
-        for assignment in existing_assignments:
-            # Same time slot conflicts
-            if assignment['timeslot'].id == timeslot.id:
-                # Faculty conflict - same faculty can't be in two places
-                if assignment['faculty'].id == faculty.id:
-                    return True
-                
-                # Room conflict - same room can't host two classes
-                if assignment['room'].id == room.id:
-                    return True
+        # Faculty conflict - same faculty can't be in two places
+        if (timeslot.id, faculty.id) in self._busy_faculty:
+            return True
+        
+        # Room conflict - same room can't host two classes
+        if (timeslot.id, room.id) in self._busy_rooms:
+            return True
         
         return False
     